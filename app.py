@@ -1,25 +1,249 @@
+import asyncio
+import io
+import math
 import os
-from typing import List, Literal, Optional
+from contextlib import aclosing, asynccontextmanager
+from functools import lru_cache
+from hashlib import blake2b
+from operator import itemgetter
+from typing import Any, AsyncIterator, Awaitable, Callable, List, Literal, Optional, TypeVar
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
 from google import genai
-import json
+from google.genai import types
+import httpx
+from cachetools import TTLCache
+import redis.asyncio as aioredis
+import ijson
+import msgspec
+import orjson
 from dotenv import load_dotenv
 import logging
-logging.basicConfig(level=logging.DEBUG)
 load_dotenv(override=True)
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper())
 
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 if not GEMINI_API_KEY:
     raise EnvironmentError("GEMINI_API_KEY environment variable not set")
 
-client = genai.Client(api_key=GEMINI_API_KEY)
+# Reuse pooled HTTP/2 connections to Gemini across requests instead of re-handshaking
+_GEMINI_HTTP_ARGS = {
+    "http2": True,
+    "limits": httpx.Limits(max_connections=100, max_keepalive_connections=50, keepalive_expiry=300),
+}
+client = genai.Client(
+    api_key=GEMINI_API_KEY,
+    http_options=types.HttpOptions(client_args=_GEMINI_HTTP_ARGS, async_client_args=_GEMINI_HTTP_ARGS)
+)
+
+# Gemini responses keyed by prompt hash, so identical submissions skip the LLM round-trip.
+# Each worker keeps its own cache unless REDIS_URL points all workers at a shared one.
+CACHE_TTL = 3600
+REDIS_URL = os.getenv("REDIS_URL")
+_response_cache = TTLCache(maxsize=10000, ttl=CACHE_TTL)
+# Short socket timeouts so an unreachable Redis degrades to cache misses instead of hanging requests
+_redis = (
+    aioredis.from_url(REDIS_URL, decode_responses=True, socket_timeout=0.5, socket_connect_timeout=0.5)
+    if REDIS_URL else None
+)
+
+
+async def _cache_get(key: str) -> Optional[str]:
+    """Returns the cached content, or None on a miss or when the cache is unavailable."""
+    if _redis is not None:
+        try:
+            return await _redis.get(key)
+        except Exception as e:
+            logging.warning("Redis cache read failed, treating as a miss: %s", e)
+            return None
+    return _response_cache.get(key)
+
+
+async def _cache_set(key: str, content: str) -> None:
+    """Best-effort write; a failure is logged and the caller keeps its result."""
+    if _redis is not None:
+        try:
+            await _redis.set(key, content, ex=CACHE_TTL)
+        except Exception as e:
+            logging.warning("Redis cache write failed: %s", e)
+    else:
+        _response_cache[key] = content
+
+
+def _prompt_key(prompt: str) -> str:
+    return blake2b(prompt.encode()).hexdigest()
+
+
+T = TypeVar("T")
+
+
+async def cached_generate(prompt: str, config: types.GenerateContentConfig, parse: Callable[[str], T]) -> T:
+    """Returns `parse` applied to the completion; only text that parses is cached."""
+    key = _prompt_key(prompt)
+    content = await _cache_get(key)
+    if content is not None:
+        return parse(content)
+    resp = await client.aio.models.generate_content(
+        model="gemini-2.0-flash",
+        contents=prompt,
+        config=config
+    )
+    content = resp.text
+    result = parse(content)
+    await _cache_set(key, content)
+    return result
+
+
+async def stream_items(
+    prompt: str,
+    config: types.GenerateContentConfig,
+    kv: bool = False,
+    buf: Optional[bytearray] = None,
+) -> AsyncIterator[Any]:
+    """Streams a Gemini completion, yielding top-level JSON items as soon as each one is complete.
+
+    Yields array elements, or with `kv` the `(key, value)` members of the top-level
+    object. The raw completion text is accumulated into `buf` when given.
+    """
+    results = ijson.sendable_list()
+    if kv:
+        parser = ijson.kvitems_coro(results, "", use_float=True)
+    else:
+        parser = ijson.items_coro(results, "item", use_float=True)
+    if buf is None:
+        buf = bytearray()
+    yielded = 0
+    stream = await client.aio.models.generate_content_stream(
+        model="gemini-2.0-flash",
+        contents=prompt,
+        config=config
+    )
+    # aclosing releases the HTTP stream as soon as the consumer stops early
+    async with aclosing(stream):
+        async for chunk in stream:
+            if not chunk.text:
+                continue
+            data = chunk.text.encode()
+            buf += data
+            parser.send(data)
+            while yielded < len(results):
+                yield results[yielded]
+                yielded += 1
+    parser.close()
+    while yielded < len(results):
+        yield results[yielded]
+        yielded += 1
+
+
+async def stream_json(prompt: str, config: types.GenerateContentConfig, kv: bool = False) -> tuple[str, Any]:
+    """Streams a Gemini completion and parses it while it arrives.
+
+    Returns the raw text together with the top-level array items, or with `kv`
+    the top-level object as a dict.
+    """
+    buf = bytearray()
+    items = [item async for item in stream_items(prompt, config, kv, buf)]
+    return buf.decode(), dict(items) if kv else items
+
+
+async def cached_stream_json(prompt: str, config: types.GenerateContentConfig, kv: bool = False) -> Any:
+    key = _prompt_key(prompt)
+    content = await _cache_get(key)
+    if content is not None:
+        return orjson.loads(content)
+    content, data = await stream_json(prompt, config, kv)
+    if content:
+        await _cache_set(key, content)
+    return data
+
+
+class DynBatcher:
+    """Coalesces requests arriving within `max_delay` seconds into one `infer` call.
+
+    `infer` returns one result per item; an Exception in a slot fails only that caller.
+    """
+
+    def __init__(
+        self,
+        infer: Callable[[List[Any]], Awaitable[List[Any]]],
+        max_batch_size: int = 8,
+        max_delay: float = 0.05,
+    ):
+        self._infer = infer
+        self._max_batch_size = max_batch_size
+        self._max_delay = max_delay
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._worker: Optional[asyncio.Task] = None
+        self._inflight: set[asyncio.Task] = set()
+
+    def start(self) -> None:
+        self._worker = asyncio.create_task(self._collect())
+
+    async def stop(self) -> None:
+        if self._worker is not None:
+            self._worker.cancel()
+            await asyncio.gather(self._worker, return_exceptions=True)
+            self._worker = None
+        await asyncio.gather(*self._inflight, return_exceptions=True)
+
+    async def process_batched(self, item: Any) -> Any:
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future))
+        return await future
+
+    async def _collect(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self._max_delay
+            while len(batch) < self._max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            # Dispatch without waiting so the next batch can start filling
+            task = asyncio.create_task(self._dispatch(batch))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _dispatch(self, batch: List[tuple]) -> None:
+        try:
+            results = await self._infer([item for item, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    dyn_batcher.start()
+    yield
+    await dyn_batcher.stop()
+    await client.aio.aclose()
+    if _redis is not None:
+        await _redis.aclose()
+
 
 app = FastAPI(
     title="Assignment Evaluation API",
     description="Evaluate student assignments and provide SWOT analysis using Gemini LLM",
     version="1.0.0",
-    debug=True
+    debug=os.getenv("DEBUG", "").lower() in ("1", "true"),
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan
 )
 
 # Pydantic models
@@ -44,6 +268,36 @@ class ScoreResponse(BaseModel):
     details: List[ScoreDetail]
 
 
+# msgspec mirrors of the /evaluate response, encoded straight to bytes.
+# The Pydantic models above still document the schema via response_model.
+class ScoreDetailMsg(msgspec.Struct):
+    question_id: str
+    question: str
+    score: float
+    correct: bool
+    feedback: str
+
+class ScoreResponseMsg(msgspec.Struct):
+    total_score: float
+    details: List[ScoreDetailMsg]
+
+class BatchEvaluationMsg(msgspec.Struct):
+    job_id: Optional[str]
+    state: str
+    results: dict[int, ScoreResponseMsg]
+    errors: dict[int, str]
+
+
+class BatchEvaluationRequest(BaseModel):
+    submissions: List[Submission]
+
+class BatchEvaluationResponse(BaseModel):
+    job_id: Optional[str]  # None when every submission was answered from the cache
+    state: str
+    results: dict[int, ScoreResponse]  # keyed by index into `submissions`
+    errors: dict[int, str]
+
+
 class SWOTResponse(BaseModel):
     strengths: str
     weaknesses: str
@@ -96,39 +350,83 @@ class AlternativeRequest(BaseModel):
     questionType: Literal["SHORT_ANSWER", "MCQ", "LONG_ANSWER"]
     subject: str
 
+# Shape Gemini returns for each evaluated question
+class EvaluationEntry(BaseModel):
+    question: str
+    score: float
+    correct: bool
+    feedback: str
 
-def build_question_generation_prompt(payload: QuestionGenerationRequest) -> str:
-    return f"""
+
+# Structured output: Gemini returns JSON matching these schemas, with no code fences
+def _json_config(schema: Any) -> types.GenerateContentConfig:
+    return types.GenerateContentConfig(response_mime_type="application/json", response_schema=schema)
+
+_EVAL_CONFIG = _json_config(list[EvaluationEntry])
+_BATCH_EVAL_CONFIG = _json_config(list[list[EvaluationEntry]])
+_SWOT_CONFIG = _json_config(SWOTResponse)
+_QUESTION_GENERATION_CONFIG = _json_config(QuestionGenerationResponse)
+_ALTERNATIVE_CONFIG = _json_config(AlternativeQuestion)
+
+# Batch API request lines are raw REST JSON, so the EvaluationEntry schema is converted
+# to its camelCase REST form once at import time
+_BATCH_API_GENERATION_CONFIG = _json_config(
+    types.Schema.from_json_schema(
+        json_schema=types.JSONSchema(type="array", items=types.JSONSchema(**EvaluationEntry.model_json_schema())),
+        api_option="GEMINI_API",
+    )
+).model_dump(mode="json", by_alias=True, exclude_none=True)
+
+
+# Prompts put their static instructions first and the request-specific values last,
+# so repeated calls share an identical prefix that Gemini can cache.
+_QUESTION_GENERATION_PREAMBLE = """
 You are a highly experienced school teacher tasked with creating a test.
 
-Please generate {payload.number_of_questions} **{payload.question_type}** questions based on the topic **{payload.topics}**, for the subject **{payload.subject}**, targeted at **{payload.class_}** students. The difficulty should be **{payload.difficulty}** level.
+Please generate the number and type of questions given under PARAMETERS below, based on the topic given there, for that subject, targeted at students of that class. The difficulty should be the level given there.
 
 Make sure the questions:
 - Are clear and age-appropriate.
 - Do NOT repeat the same concept.
-- Follow these instructions: {payload.instructions}
+- Follow the instructions given under PARAMETERS.
 
-For each question, provide an expected answer clearly. Return the output as a JSON array with fields:
+For each question, provide an expected answer clearly. Return the output as a JSON object with a single `questions` array, where each element has the fields:
 - `question`: the full question text.
-- `expected_answer`: the correct answer to that question. 
+- `expected_answer`: the correct answer to that question.
 
 ### Example format:
-  {{
+{
   "questions": [
-    {{
+    {
       "question": "Your generated question here",
       "expected_answer": "The correct answer here"
-    }},
+    },
     ...
   ]
-}}
-  ...
+}
 
-ONLY return a valid JSON array and nothing else. Now generate the questions:
-    """
+ONLY return this JSON object and nothing else.
+"""
+
+_QUESTION_GENERATION_PARAMETERS = """---
+PARAMETERS:
+- Number of questions: {number_of_questions}
+- Question type: **{question_type}**
+- Topic: **{topics}**
+- Subject: **{subject}**
+- Class: **{class_}**
+- Difficulty: **{difficulty}**
+- Instructions: {instructions}
+
+Now generate the questions:
+"""
 
-def build_evaluation_prompt(items: List[QuestionItem]) -> str:
-    prompt = (
+
+def build_question_generation_prompt(payload: QuestionGenerationRequest) -> str:
+    return _QUESTION_GENERATION_PREAMBLE + _QUESTION_GENERATION_PARAMETERS.format_map(vars(payload))
+
+
+_EVAL_HEADER = (
         """
         You are an expert teacher with deep knowledge in the subject matter. Evaluate the following student responses to a set of questions. For each response, provide a detailed assessment by:
         Assigning a score out of 0-10 based on accuracy, completeness, and clarity.
@@ -136,20 +434,48 @@ def build_evaluation_prompt(items: List[QuestionItem]) -> str:
         Providing customized, constructive feedback that highlights strengths, identifies errors or gaps, and offers specific guidance for improvement. Make sure it sounds very natural and personalised like an actual person would advise.
         Return the evaluation as a JSON array, where each object contains the fields: question (the question text or identifier), score (integer from 0 to 10), correct (boolean), and feedback (a string with detailed feedback). Ensure the feedback is clear, encouraging, and actionable.
         """
-    )
-    for idx, item in enumerate(items, 1):
-        prompt += f"{idx}. Question: {item.question}\n"
-        prompt += f"Student Answer: {item.actual_answer}\n"
-        prompt += f"Expected Answer: {item.expected_answer}\n\n"
-    return prompt
+)
 
 
-def build_swot_prompt(items: List[QuestionItem]) -> str:
-    context = "\n".join(
-        f"Question: {item.question}\nStudent Answer: {item.actual_answer}\nExpected Answer: {item.expected_answer}\n"
-        for item in items
+def _frozen_items(items: List[QuestionItem]) -> tuple:
+    return tuple((item.question, item.actual_answer, item.expected_answer) for item in items)
+
+
+def _eval_item_parts(frozen_items: tuple):
+    return (
+        f"{idx}. Question: {question}\nStudent Answer: {actual_answer}\nExpected Answer: {expected_answer}\n\n"
+        for idx, (question, actual_answer, expected_answer) in enumerate(frozen_items, 1)
     )
-    prompt = (
+
+
+# Retries and duplicate submissions reuse both the prompt and its response-cache key
+@lru_cache(maxsize=2048)
+def _evaluation_prompt_and_key(frozen_items: tuple) -> tuple[str, str]:
+    parts = [_EVAL_HEADER]
+    parts.extend(_eval_item_parts(frozen_items))
+    prompt = "".join(parts)
+    return prompt, _prompt_key(prompt)
+
+
+def evaluation_prompt_and_key(items: List[QuestionItem]) -> tuple[str, str]:
+    return _evaluation_prompt_and_key(_frozen_items(items))
+
+
+def build_batch_evaluation_prompt(submissions: List[List[QuestionItem]]) -> str:
+    parts = [
+        _EVAL_HEADER,
+        "The responses below come from several separate submissions, each under its own "
+        "### Submission heading. Evaluate every submission independently and return a JSON array "
+        "with one entry per submission, in the same order, where each entry is the JSON array of "
+        "evaluations for that submission.\n\n",
+    ]
+    for k, items in enumerate(submissions, 1):
+        parts.append(f"### Submission {k}\n")
+        parts.extend(_eval_item_parts(_frozen_items(items)))
+    return "".join(parts)
+
+
+_SWOT_PREAMBLE = (
         """
 You are an educational expert with extensive experience in student assessment and performance analysis.
 
@@ -173,72 +499,202 @@ Return the SWOT analysis as a single JSON object with these four keys:
 
 Be detailed, constructive, and base your analysis on overall trends, not per-question breakdowns.
 
-""" + context
+"""
+)
+
+
+def build_swot_prompt(items: List[QuestionItem]) -> str:
+    context = "\n".join(
+        f"Question: {item.question}\nStudent Answer: {item.actual_answer}\nExpected Answer: {item.expected_answer}\n"
+        for item in items
     )
-    return prompt
-
-def build_alternatives_prompt(req: AlternativeRequest) -> str:
-    qtype_map = {
-        "SHORT_ANSWER": "short answer",
-        "MCQ": "multiple choice (MCQ)",
-        "LONG_ANSWER": "long answer"
-    }
-    base = (
-        f"You are a exper , creative teacher. Generate *three* distinct {qtype_map[req.questionType]} "
-        f"questions (with expected answers) on the subtopic **{req.subtopic}**, "
-        f"for a **{req.difficulty}**-level {req.subject} test worth **{req.marks}** marks each.\n"
-        f"Use the provided question ID **{req.id}** for all three questions.\n"
-        f"Include in your JSON output for each question:\n"
-        " - `id`: the provided ID \n"
-        " - `type`: one of SHORT_ANSWER, MCQ, LONG_ANSWER\n"
-        " - `text`: the question prompt (include marks and difficulty in brackets)\n"
-        " - `answer_type`: \"Text\"\n"
-        " - `expected_answer`: the correct answer\n"
-        " - `marks`: how many marks\n"
+    return _SWOT_PREAMBLE + context
+
+
+# Each variant is generated by its own call, so give each one a different angle to keep them distinct
+_ALTERNATIVE_ANGLES = (
+    "checks recall and understanding of a core idea",
+    "applies the idea to a concrete problem or real-world scenario",
+    "asks the student to analyse, compare or explain their reasoning",
+)
+
+
+_QTYPE_NAMES = {
+    "SHORT_ANSWER": "short answer",
+    "MCQ": "multiple choice (MCQ)",
+    "LONG_ANSWER": "long answer"
+}
+
+_ALTERNATIVE_SCHEMA = (
+    "Include in your JSON output:\n"
+    " - `id`: the provided ID \n"
+    " - `type`: one of SHORT_ANSWER, MCQ, LONG_ANSWER\n"
+    " - `text`: the question prompt (include marks and difficulty in brackets)\n"
+    " - `answer_type`: \"Text\"\n"
+    " - `expected_answer`: the correct answer\n"
+    " - `marks`: how many marks\n"
+)
+
+_MCQ_SCHEMA = (
+    " - `options`: list of four `{id, text}` objects representing the choices.\n"
+    " - `expected_answer`: the `id` of the correct option.\n"
+)
+
+_ALTERNATIVE_PREAMBLE = (
+    "You are a exper , creative teacher. Generate *one* question (with expected answer) "
+    "of the question type, subtopic, subject, difficulty and marks given under PARAMETERS below, "
+    "taking the angle given there.\n"
+    "Use the provided question ID for the question.\n"
+)
+
+_ALTERNATIVE_FOOTER = "\nReturn a single JSON object exactly matching this schema.\n"
+
+
+def build_single_alternative_prompt(req: AlternativeRequest, variant_idx: int) -> str:
+    parameters = (
+        "---\nPARAMETERS:\n"
+        f"- Question type: {_QTYPE_NAMES[req.questionType]}\n"
+        f"- Subtopic: **{req.subtopic}**\n"
+        f"- Subject: {req.subject}\n"
+        f"- Difficulty: **{req.difficulty}**\n"
+        f"- Marks: **{req.marks}**\n"
+        f"- Question ID: **{req.id}**\n"
+        f"- Angle: the question {_ALTERNATIVE_ANGLES[variant_idx]}\n"
     )
     if req.questionType == "MCQ":
-        base += (
-            " - `options`: list of four `{id, text}` objects representing the choices.\n"
-            " - `expected_answer`: the `id` of the correct option.\n"
-        )
-    base += "\nReturn a JSON array of objects exactly matching this schema."
-    return base
+        return "".join((_ALTERNATIVE_PREAMBLE, _ALTERNATIVE_SCHEMA, _MCQ_SCHEMA, _ALTERNATIVE_FOOTER, parameters))
+    return "".join((_ALTERNATIVE_PREAMBLE, _ALTERNATIVE_SCHEMA, _ALTERNATIVE_FOOTER, parameters))
+
+
+def _check_entry_count(entries: Any, expected: int) -> None:
+    if not isinstance(entries, list) or len(entries) != expected:
+        got = len(entries) if isinstance(entries, list) else 0
+        raise ValueError(f"Expected {expected} evaluations, got {got}")
+
+
+async def _evaluate_alone(submission: Submission, prompt: str, key: str) -> list:
+    _, entries = await stream_json(prompt, _EVAL_CONFIG)
+    _check_entry_count(entries, len(submission.items))
+    await _cache_set(key, orjson.dumps(entries).decode())
+    return entries
+
+
+async def evaluate_batch(submissions: List[Submission]) -> List[Any]:
+    results: List[Any] = [None] * len(submissions)
+    misses = []
+    for i, submission in enumerate(submissions):
+        prompt, key = evaluation_prompt_and_key(submission.items)
+        content = await _cache_get(key)
+        if content is None:
+            misses.append((i, key, prompt))
+        else:
+            results[i] = orjson.loads(content)
+    if not misses:
+        return results
+
+    retry = misses
+    if len(misses) > 1:
+        prompt = build_batch_evaluation_prompt([submissions[i].items for i, _, _ in misses])
+        try:
+            _, raw = await stream_json(prompt, _BATCH_EVAL_CONFIG)
+        except Exception:
+            logging.exception("Batched evaluation failed; evaluating submissions individually")
+            raw = None
+        if not isinstance(raw, list) or len(raw) != len(misses):
+            raw = [None] * len(misses)
+
+        # Cache each submission under its own prompt key so single-submission retries hit
+        retry = []
+        for miss, entries in zip(misses, raw):
+            i, key, _ = miss
+            try:
+                _check_entry_count(entries, len(submissions[i].items))
+            except ValueError:
+                retry.append(miss)
+                continue
+            await _cache_set(key, orjson.dumps(entries).decode())
+            results[i] = entries
+
+    # Slices the batched call got wrong are re-run alone, so a failure only reaches its own caller
+    outcomes = await asyncio.gather(
+        *[_evaluate_alone(submissions[i], prompt, key) for i, key, prompt in retry],
+        return_exceptions=True
+    )
+    for (i, _, _), outcome in zip(retry, outcomes):
+        results[i] = outcome
+    return results
+
+
+dyn_batcher = DynBatcher(evaluate_batch, max_batch_size=8, max_delay=0.05)
+
+
+# All four fields are required by the EvaluationEntry response schema
+_entry_fields = itemgetter("question", "score", "correct", "feedback")
+
+
+def _score_detail(entry: dict, question_id: str) -> ScoreDetailMsg:
+    question, score, correct, feedback = _entry_fields(entry)
+    return ScoreDetailMsg(
+        question_id=question_id,
+        question=question,
+        score=float(score),
+        correct=bool(correct),
+        feedback=feedback
+    )
+
+
+def _score_response(raw: list, question_ids) -> ScoreResponseMsg:
+    # Match each returned entry to the original submission item by index
+    details = [_score_detail(entry, question_id) for entry, question_id in zip(raw, question_ids)]
+    return ScoreResponseMsg(total_score=math.fsum(detail.score for detail in details), details=details)
+
+
+async def _evaluation_entries(prompt: str, key: str, items: List[QuestionItem]) -> AsyncIterator[dict]:
+    """Yields one entry per item, raising if Gemini returns any other number; only complete results are cached."""
+    content = await _cache_get(key)
+    if content is not None:
+        for entry in orjson.loads(content):
+            yield entry
+        return
+    buf = bytearray()
+    count = 0
+    async with aclosing(stream_items(prompt, _EVAL_CONFIG, buf=buf)) as entries:
+        async for entry in entries:
+            count += 1
+            if count > len(items):
+                raise ValueError(f"Expected {len(items)} evaluations, got more than {len(items)}")
+            yield entry
+    if count != len(items):
+        raise ValueError(f"Expected {len(items)} evaluations, got {count}")
+    await _cache_set(key, buf.decode())
+
+
+async def stream_evaluation(submission: Submission) -> AsyncIterator[bytes]:
+    """Yields one NDJSON line per scored question, then a final `total_score` line."""
+    scores = []
+    originals = iter(submission.items)
+    try:
+        async for entry in _evaluation_entries(*evaluation_prompt_and_key(submission.items), submission.items):
+            detail = _score_detail(entry, next(originals).question_id)
+            scores.append(detail.score)
+            yield msgspec.json.encode(detail) + b"\n"
+        yield msgspec.json.encode({"total_score": math.fsum(scores)}) + b"\n"
+    except Exception as e:
+        # Headers are already sent, so report the failure in-band
+        logging.exception("Failed to stream evaluation")
+        yield msgspec.json.encode({"error": str(e)}) + b"\n"
+
 
 # Endpoint 1: evaluation
 @app.post("/evaluate", response_model=ScoreResponse)
-async def evaluate(submission: Submission):
-    prompt = build_evaluation_prompt(submission.items)
+async def evaluate(submission: Submission, stream: bool = False):
+    if stream:
+        # Streaming bypasses the batcher so the first score is sent as soon as Gemini produces it
+        return StreamingResponse(stream_evaluation(submission), media_type="application/x-ndjson")
     try:
-        resp = client.models.generate_content(
-            model="gemini-2.0-flash",
-            contents=prompt
-        )
-        content = resp.text
-        if content.strip().startswith("```"):
-            lines = content.strip().splitlines()
-            content = "\n".join(lines[1:-1])
-
-        raw = json.loads(content)
-        total = 0.0
-        details = []
-
-        # Match each returned entry to the original submission item by index
-        for entry, original_item in zip(raw, submission.items):
-            score = float(entry.get("score", 0))
-            correct = bool(entry.get("correct", False))
-            feedback = entry.get("feedback", "")
-            question = entry.get("question", "")
-
-            details.append(ScoreDetail(
-                question_id=original_item.question_id,  # add this line
-                question=question,
-                score=score,
-                correct=correct,
-                feedback=feedback
-            ))
-            total += score
-
-        return ScoreResponse(total_score=total, details=details)
+        raw = await dyn_batcher.process_batched(submission)
+        response = _score_response(raw, (item.question_id for item in submission.items))
+        return Response(msgspec.json.encode(response), media_type="application/json")
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -251,16 +707,7 @@ async def evaluate(submission: Submission):
 async def swot_analysis(submission: Submission):
     prompt = build_swot_prompt(submission.items)
     try:
-        resp = client.models.generate_content(
-            model="gemini-2.0-flash",
-            contents=prompt
-        )
-        content = resp.text
-        if content.strip().startswith("```"):
-            lines = content.strip().splitlines()
-            content = "\n".join(lines[1:-1])
-        import json
-        data = json.loads(content)
+        data = await cached_stream_json(prompt, _SWOT_CONFIG, kv=True)
         return SWOTResponse(
         strengths=data.get("strengths", ""),
         weaknesses=data.get("weaknesses", ""),
@@ -270,43 +717,19 @@ async def swot_analysis(submission: Submission):
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    
-@app.post("/generate-qa", response_model=QuestionGenerationResponse)
-async def generate_questions(request: QuestionGenerationRequest):
-    prompt = build_question_generation_prompt(request)
-    try:
-        response = client.models.generate_content(
-            model="gemini-2.0-flash",
-            contents=prompt
-        )
-        content = response.text.strip()
-
-        # 🔍 1. Remove code block markers (``` or ```json)
-        if content.startswith("```"):
-            lines = content.splitlines()
-            content = "\n".join(line for line in lines if not line.strip().startswith("```"))
 
 
-        # 🧠 2. Load JSON
-        parsed = json.loads(content)
+def _parse_generated_questions(content: str) -> QuestionGenerationResponse:
+    # Structured output, so no code fences to strip; validating straight from JSON
+    # rejects a missing "questions" key or a null/missing field in one pass
+    return QuestionGenerationResponse.model_validate_json(content)
 
-        # 🧩 3. If it's a list, grab the first element
-        if isinstance(parsed, list):
-            if len(parsed) == 0:
-                raise HTTPException(status_code=500, detail="Gemini returned an empty list")
-            parsed = parsed[0]  # Get the first item, which should be a dict
 
-        # 🛡 4. Make sure parsed is a dict with "questions"
-        if not isinstance(parsed, dict) or "questions" not in parsed:
-            raise HTTPException(status_code=500, detail="Unexpected Gemini response structure")
-
-        # ✅ 5. Build response
-        return QuestionGenerationResponse(
-            questions=[
-                GeneratedQuestion(question=q.get("question"), expected_answer=q.get("expected_answer"))
-                for q in parsed["questions"]
-            ]
-        )
+@app.post("/generate-qa", response_model=QuestionGenerationResponse)
+async def generate_questions(request: QuestionGenerationRequest):
+    prompt = build_question_generation_prompt(request)
+    try:
+        return await cached_generate(prompt, _QUESTION_GENERATION_CONFIG, _parse_generated_questions)
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Gemini Error: {str(e)}")
@@ -320,33 +743,119 @@ async def generate_questions(request: QuestionGenerationRequest):
     summary="Generate three alternative questions for a given subtopic"
 )
 async def generate_alternatives(req: AlternativeRequest):
-    prompt = build_alternatives_prompt(req)
+    async def run_one(variant_idx: int) -> AlternativeQuestion:
+        # Validate & cast into Pydantic models (will raise if mismatch) before the reply is cached
+        return await cached_generate(
+            build_single_alternative_prompt(req, variant_idx),
+            _ALTERNATIVE_CONFIG,
+            lambda content: AlternativeQuestion(**orjson.loads(content)),
+        )
+
     try:
-        resp = client.models.generate_content(
+        return await asyncio.gather(*[run_one(i) for i in range(len(_ALTERNATIVE_ANGLES))])
+
+    except Exception as e:
+        logging.exception("Failed to generate alternatives")
+        raise HTTPException(status_code=500, detail=f"Gemini error: {e}")
+
+
+
+def _batch_response(
+    job_id: Optional[str],
+    state: str,
+    results: dict[int, ScoreResponseMsg],
+    errors: dict[int, str],
+) -> Response:
+    body = BatchEvaluationMsg(job_id=job_id, state=state, results=results, errors=errors)
+    return Response(msgspec.json.encode(body), media_type="application/json")
+
+
+@app.post(
+    "/evaluate-batch",
+    response_model=BatchEvaluationResponse,
+    summary="Queue many submissions for offline evaluation through the Gemini Batch API"
+)
+async def submit_evaluation_batch(request: BatchEvaluationRequest):
+    """Cached submissions are scored immediately; the rest go into one Batch API job.
+
+    Poll `GET /evaluate-batch/{job_id}` for the remaining results. Results returned
+    here are not repeated there.
+    """
+    results: dict[int, ScoreResponseMsg] = {}
+    lines = []
+    for i, submission in enumerate(request.submissions):
+        question_ids = [item.question_id for item in submission.items]
+        prompt, key = evaluation_prompt_and_key(submission.items)
+        content = await _cache_get(key)
+        if content is not None:
+            results[i] = _score_response(orjson.loads(content), question_ids)
+            continue
+        # The key carries everything needed to rebuild the response once the job finishes
+        line_key = orjson.dumps({"index": i, "cache_key": key, "question_ids": question_ids}).decode()
+        lines.append(orjson.dumps({
+            "key": line_key,
+            "request": {
+                "contents": [{"role": "user", "parts": [{"text": prompt}]}],
+                "generationConfig": _BATCH_API_GENERATION_CONFIG,
+            },
+        }))
+    if not lines:
+        return _batch_response(None, types.JobState.JOB_STATE_SUCCEEDED.value, results, {})
+
+    try:
+        uploaded = await client.aio.files.upload(
+            file=io.BytesIO(b"\n".join(lines)),
+            config=types.UploadFileConfig(display_name="evaluate-batch", mime_type="jsonl")
+        )
+        job = await client.aio.batches.create(
             model="gemini-2.0-flash",
-            contents=prompt
+            src=uploaded.name,
+            config=types.CreateBatchJobConfig(display_name="evaluate-batch")
         )
-        content = resp.text.strip()
-
-        # strip code fences if present
-        if content.startswith("```"):
-            lines = content.splitlines()
-            content = "\n".join(line for line in lines if not line.strip().startswith("```"))
+    except Exception as e:
+        logging.exception("Failed to create evaluation batch job")
+        raise HTTPException(status_code=500, detail=f"Gemini error: {e}")
 
-        parsed = json.loads(content)
-        if not isinstance(parsed, list) or len(parsed) != 3:
-            raise ValueError("Expected a JSON array of length 3")
+    return _batch_response(job.name, (job.state or types.JobState.JOB_STATE_UNSPECIFIED).value, results, {})
 
-        # Validate & cast into Pydantic models (will raise if mismatch)
-        questions = [AlternativeQuestion(**q) for q in parsed]
-        return questions
 
+@app.get(
+    "/evaluate-batch/{job_id:path}",
+    response_model=BatchEvaluationResponse,
+    summary="Poll a Batch API evaluation job and collect its results"
+)
+async def get_evaluation_batch(job_id: str):
+    try:
+        job = await client.aio.batches.get(name=job_id)
+        results: dict[int, ScoreResponseMsg] = {}
+        errors: dict[int, str] = {}
+        if job.dest is not None and job.dest.file_name:
+            data = await client.aio.files.download(file=job.dest.file_name)
+            for line in data.splitlines():
+                if not line.strip():
+                    continue
+                row = orjson.loads(line)
+                meta = orjson.loads(row["key"])
+                index = meta["index"]
+                if "error" in row:
+                    errors[index] = row["error"].get("message", "Batch request failed")
+                    continue
+                try:
+                    content = types.GenerateContentResponse.model_validate(row["response"]).text
+                    entries = orjson.loads(content)
+                    _check_entry_count(entries, len(meta["question_ids"]))
+                    results[index] = _score_response(entries, meta["question_ids"])
+                except Exception as e:
+                    errors[index] = str(e)
+                    continue
+                await _cache_set(meta["cache_key"], content)
     except Exception as e:
-        logging.exception("Failed to generate alternatives")
+        logging.exception("Failed to fetch evaluation batch job")
         raise HTTPException(status_code=500, detail=f"Gemini error: {e}")
 
+    return _batch_response(job.name, (job.state or types.JobState.JOB_STATE_UNSPECIFIED).value, results, errors)
+
 
-    
 @app.get("/health-check")
 async def health_check():
     return {"status": "ok"}
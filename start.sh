@@ -1 +1 @@
-uvicorn app:app --host 0.0.0.0 --port 10000
\ No newline at end of file
+uvicorn app:app --host 0.0.0.0 --port 10000 --workers "${WEB_CONCURRENCY:-$(nproc)}" --loop uvloop --http httptools
\ No newline at end of file
@@ -0,0 +1,57 @@
+import asyncio
+import json
+import os
+import sys
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GEMINI_API_KEY", "test-key")
+
+import pytest
+
+import app
+
+
+class FakeModels:
+    """Stands in for `client.aio.models`, answering each prompt with `reply(prompt)`.
+
+    A `str` reply is sent as-is; anything else is JSON-encoded first.
+    """
+
+    def __init__(self, reply):
+        self.reply = reply
+        self.prompts = []
+
+    def _text(self, prompt):
+        self.prompts.append(prompt)
+        reply = self.reply(prompt)
+        return reply if isinstance(reply, str) else json.dumps(reply)
+
+    async def generate_content(self, model, contents, config=None):
+        return SimpleNamespace(text=self._text(contents))
+
+    async def generate_content_stream(self, model, contents, config=None):
+        text = self._text(contents)
+
+        async def chunks():
+            for i in range(0, len(text), 16):
+                await asyncio.sleep(0)
+                yield SimpleNamespace(text=text[i:i + 16])
+
+        return chunks()
+
+
+@pytest.fixture(autouse=True)
+def fresh_cache(monkeypatch):
+    monkeypatch.setattr(app, "_response_cache", app.TTLCache(maxsize=100, ttl=60))
+    monkeypatch.setattr(app, "_redis", None)
+
+
+@pytest.fixture
+def fake_models(monkeypatch):
+    def install(reply):
+        models = FakeModels(reply)
+        monkeypatch.setattr(app, "client", SimpleNamespace(aio=SimpleNamespace(models=models)))
+        return models
+
+    return install
@@ -0,0 +1,185 @@
+import asyncio
+import json
+import re
+from types import SimpleNamespace
+
+import app
+
+
+def make_submission(tag, n):
+    return app.Submission(items=[
+        app.QuestionItem(question_id=f"{tag}{k}", question=f"{tag} question {k}", actual_answer="a", expected_answer="b")
+        for k in range(n)
+    ])
+
+
+def entries(n, score=5):
+    return [{"question": "q", "score": score, "correct": True, "feedback": "f"} for _ in range(n)]
+
+
+def test_batcher_coalesces_and_fails_only_the_bad_slot():
+    calls = []
+
+    async def infer(items):
+        calls.append(list(items))
+        return [ValueError("bad") if item == 3 else item * 2 for item in items]
+
+    async def run():
+        batcher = app.DynBatcher(infer, max_batch_size=4, max_delay=0.02)
+        batcher.start()
+        try:
+            return await asyncio.gather(*[batcher.process_batched(i) for i in range(6)], return_exceptions=True)
+        finally:
+            await batcher.stop()
+
+    results = asyncio.run(run())
+    assert calls == [[0, 1, 2, 3], [4, 5]]
+    assert results[:3] == [0, 2, 4] and results[4:] == [8, 10]
+    assert isinstance(results[3], ValueError)
+
+
+def test_batcher_fails_every_caller_when_infer_raises():
+    async def infer(items):
+        raise RuntimeError("down")
+
+    async def run():
+        batcher = app.DynBatcher(infer, max_batch_size=4, max_delay=0.01)
+        batcher.start()
+        try:
+            return await asyncio.gather(*[batcher.process_batched(i) for i in range(2)], return_exceptions=True)
+        finally:
+            await batcher.stop()
+
+    assert all(isinstance(r, RuntimeError) for r in asyncio.run(run()))
+
+
+def test_evaluate_batch_demuxes_per_submission(fake_models):
+    models = fake_models(lambda prompt: [entries(2), entries(3)])
+    first, second = make_submission("a", 2), make_submission("b", 3)
+
+    results = asyncio.run(app.evaluate_batch([first, second]))
+
+    assert [len(r) for r in results] == [2, 3]
+    assert len(models.prompts) == 1
+    # Each slice is cached under its own single-submission prompt
+    assert asyncio.run(app.evaluate_batch([second])) == [entries(3)]
+    assert len(models.prompts) == 1
+
+
+def test_evaluate_batch_reruns_a_truncated_slice_alone(fake_models):
+    def reply(prompt):
+        if re.search(r"### Submission \d", prompt):
+            return [entries(2), entries(1)]  # second submission truncated
+        return entries(3, score=7)
+
+    models = fake_models(reply)
+    first, second = make_submission("a", 2), make_submission("b", 3)
+
+    results = asyncio.run(app.evaluate_batch([first, second]))
+
+    assert len(results[0]) == 2
+    assert results[1] == entries(3, score=7)
+    assert len(models.prompts) == 2
+
+
+def test_evaluate_batch_fails_only_the_caller_with_a_bad_result(fake_models):
+    def reply(prompt):
+        if re.search(r"### Submission \d", prompt):
+            return [entries(2), entries(1)]
+        return entries(1)  # still truncated when run alone
+
+    models = fake_models(reply)
+    first, second = make_submission("a", 2), make_submission("b", 3)
+
+    results = asyncio.run(app.evaluate_batch([first, second]))
+
+    assert len(results[0]) == 2
+    assert isinstance(results[1], ValueError)
+    # The truncated grade was not cached, so a retry asks Gemini again
+    asyncio.run(app.evaluate_batch([second]))
+    assert len(models.prompts) == 3
+
+
+def test_stream_evaluation_reports_and_skips_caching_a_truncated_result(fake_models):
+    models = fake_models(lambda prompt: entries(1))
+    submission = make_submission("a", 2)
+
+    async def collect():
+        return [json.loads(line) async for line in app.stream_evaluation(submission)]
+
+    lines = asyncio.run(collect())
+
+    assert lines[0]["question_id"] == "a0"
+    assert "error" in lines[-1]
+    asyncio.run(collect())
+    assert len(models.prompts) == 2
+
+
+def test_get_evaluation_batch_reports_and_skips_caching_a_length_mismatch(monkeypatch):
+    def result_line(index, question_ids, n):
+        text = json.dumps(entries(n))
+        return json.dumps({
+            "key": json.dumps({"index": index, "cache_key": f"k{index}", "question_ids": question_ids}),
+            "response": {"candidates": [{"content": {"parts": [{"text": text}], "role": "model"}}]},
+        })
+
+    async def download(file):
+        return "\n".join([result_line(0, ["a"], 1), result_line(1, ["b", "c"], 1)]).encode()
+
+    async def get(name):
+        return app.types.BatchJob(
+            name=name, state="JOB_STATE_SUCCEEDED", dest=app.types.BatchJobDestination(file_name="files/out")
+        )
+
+    monkeypatch.setattr(app, "client", SimpleNamespace(aio=SimpleNamespace(
+        files=SimpleNamespace(download=download), batches=SimpleNamespace(get=get),
+    )))
+
+    body = json.loads(asyncio.run(app.get_evaluation_batch("batches/b1")).body)
+
+    assert list(body["results"]) == ["0"]
+    assert "Expected 2 evaluations, got 1" in body["errors"]["1"]
+    assert "k0" in app._response_cache and "k1" not in app._response_cache
+
+
+def test_evaluate_batch_survives_an_unavailable_redis(fake_models, monkeypatch):
+    class DownRedis:
+        async def get(self, key):
+            raise ConnectionError("redis down")
+
+        async def set(self, key, value, ex=None):
+            raise ConnectionError("redis down")
+
+    monkeypatch.setattr(app, "_redis", DownRedis())
+    models = fake_models(lambda prompt: entries(2))
+
+    assert asyncio.run(app.evaluate_batch([make_submission("a", 2)])) == [entries(2)]
+    assert len(models.prompts) == 1
+
+
+def test_stream_evaluation_closes_the_stream_on_too_many_entries(monkeypatch):
+    closed = []
+
+    async def generate_content_stream(model, contents, config=None):
+        async def chunks():
+            try:
+                text = json.dumps(entries(4))
+                for i in range(0, len(text), 16):
+                    yield SimpleNamespace(text=text[i:i + 16])
+            finally:
+                closed.append(True)
+
+        return chunks()
+
+    models = SimpleNamespace(generate_content_stream=generate_content_stream)
+    monkeypatch.setattr(app, "client", SimpleNamespace(aio=SimpleNamespace(models=models)))
+
+    async def collect():
+        return [json.loads(line) async for line in app.stream_evaluation(make_submission("a", 2))]
+
+    lines = asyncio.run(collect())
+
+    assert [line["question_id"] for line in lines[:2]] == ["a0", "a1"]
+    assert lines[-1] == {"error": "Expected 2 evaluations, got more than 2"}
+    assert closed == [True]
+    assert len(app._response_cache) == 0
@@ -0,0 +1,29 @@
+import asyncio
+
+import orjson
+import pytest
+
+import app
+
+
+def test_cached_generate_skips_caching_a_reply_that_fails_to_parse(fake_models):
+    replies = iter(['{"questions": 1', '{"questions": []}'])
+    models = fake_models(lambda prompt: next(replies))
+
+    with pytest.raises(orjson.JSONDecodeError):
+        asyncio.run(app.cached_generate("p", None, orjson.loads))
+    assert asyncio.run(app.cached_generate("p", None, orjson.loads)) == {"questions": []}
+    assert asyncio.run(app.cached_generate("p", None, orjson.loads)) == {"questions": []}
+    assert len(models.prompts) == 2
+
+
+def test_generate_questions_rejects_a_null_field(fake_models):
+    fake_models(lambda prompt: {"questions": [{"question": "q", "expected_answer": None}]})
+
+    with pytest.raises(app.HTTPException) as exc:
+        asyncio.run(app.generate_questions(app.QuestionGenerationRequest(
+            title="t", subject="s", class_="c", start_date="d", end_date="d", question_type="Subjective",
+            number_of_questions=1, difficulty="easy", topics="x", instructions="i", description="d",
+            max_score=10, passing_score=5,
+        )))
+    assert exc.value.status_code == 500